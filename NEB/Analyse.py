@@ -3,14 +3,55 @@
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.widgets import Slider, RadioButtons
-from scipy.interpolate import splev, splrep, splder
+from scipy.interpolate import make_interp_spline
 import matplotlib.ticker as ticker
+from concurrent.futures import ProcessPoolExecutor
+from matplotlib.colors import to_rgba
 import os
 from NEB import XYZ
 from NEB.AtomicData import atom_names, atomic_number, bohr_to_angs, covalent_radii, hartree_to_eV
 
 hartree_to_ev = 27.21138
 
+def _chain_lines(files, counts):
+    """
+    iterate over the lines of several files as if they were one file,
+    the number of data lines (not empty and no comments) in each file
+    is appended to the list `counts`
+    """
+    for file in files:
+        n = 0
+        with open(file) as f:
+            for line in f:
+                if line.strip() and not line.lstrip().startswith("#"):
+                    n += 1
+                yield line
+        counts.append(n)
+
+def _read_iteration(file):
+    """
+    read the geometries and gradients of all images from the xyz-file of
+    one iteration and return them as arrays of shape (images, 3*atoms)
+    """
+    atomlists, gradients = XYZ.read_xyz_and_gradients(file)
+    images = np.array([XYZ.atomlist2vector(atomlist) for atomlist in atomlists])
+    return images, np.array(gradients).reshape(len(images), -1)
+
+# below this number of xyz-files, starting the worker processes takes longer
+# than parsing the files in the current process
+min_files_for_pool = 8
+
+def _read_iterations(files):
+    """
+    read the geometries and gradients of all iterations, the results are
+    yielded in the order of `files`. Many files are parsed in separate processes.
+    """
+    if len(files) < min_files_for_pool:
+        yield from map(_read_iteration, files)
+        return
+    with ProcessPoolExecutor(max_workers=min(len(files), os.cpu_count() or 1)) as executor:
+        yield from executor.map(_read_iteration, files)
+
 class Analyse(object): 
     """
     A class for the analysis of NEB results
@@ -44,23 +85,27 @@ class Analyse(object):
         assert len(energy_files) > 0 and len(xyz_files) > 0, "There are no result files"
 
         # read in all the energies from the path_energies_....dat files
-        self.energies = []
-        for file in energy_files:
-            self.energies.append(np.loadtxt(file, usecols=[1]))
+        # all files have one line per image, so they are parsed in a single pass
+        # and split into iterations afterwards
+        counts = []
+        energies = np.loadtxt(_chain_lines(energy_files, counts), usecols=(1,))
+        # the energies can only be split into iterations if all files have the same number of images
+        assert len(set(counts)) == 1, "The files %s contain different numbers of images: %s" % (energy_files, counts)
+        self.energies = energies.reshape(len(energy_files), -1)
         # convert Hartree to eV
-        self.energies = np.array(self.energies) * hartree_to_ev
+        self.energies *= hartree_to_ev
         # the lowest energy will be set to zero
         self.energies -= np.min(self.energies)
 
         # read in all the geometries from each iteration
-        self.R = []
-        self.F = []
-        for file in xyz_files:
-            atomlists, gradients = XYZ.read_xyz_and_gradients(file)
-            images = [XYZ.atomlist2vector(atomlist) for atomlist in atomlists]
-            self.R.append(images)
-            gradients = np.array(gradients).reshape(len(images), -1)
-            self.F.append(np.linalg.norm(gradients, axis=1))
+        # parsing the xyz-files is pure Python, so many of them are read in separate processes,
+        # the results are copied into preallocated arrays of shape (iterations, images, 3*atoms)
+        for i, (images, gradients) in enumerate(_read_iterations(xyz_files)):
+            if i == 0:
+                self.R = np.empty((len(xyz_files),) + images.shape)
+                G = np.empty_like(self.R)
+            self.R[i] = images
+            G[i] = gradients
         # try to read in the tolerance level
         with open(xyz_files[0]) as f:
             try:
@@ -68,16 +113,17 @@ class Analyse(object):
                 self.tolerance = float(f.readline().split()[-1].split("=")[-1])
             except:
                 self.tolerance = 0.06
-        self.R = np.array(self.R) * bohr_to_angs
-        self.F = np.array(self.F)
+        self.R *= bohr_to_angs
+        # norm of the gradient on each image of each iteration
+        self.F = np.sqrt(np.einsum('ijk,ijk->ij', G, G))
+        # images whose force is above the tolerance are drawn in red, the others in green
+        self.over_tolerance = self.F > self.tolerance
+        self.marker_colors = np.where(self.over_tolerance[..., None], to_rgba("#DC6058"), to_rgba("#4FDC85"))
         
         # calculate cartesian distance between geometries as x-axis
-        displacements = np.zeros([self.R.shape[0], self.R.shape[1]])
-        for i in range(self.R.shape[0]):
-            for j in range(self.R.shape[1]):
-                if j > 0:
-                    displacements[i, j] = np.linalg.norm(self.R[i, j] - self.R[i, 0])
-        displacements = displacements / displacements[:, -1].reshape(-1, 1)
+        diff = self.R - self.R[:, :1, :]
+        displacements = np.sqrt(np.einsum('ijk,ijk->ij', diff, diff))
+        displacements /= displacements[:, -1:]
         self.displacements = displacements
         # number of iterations, number of geometries in each iteration
         self.n_iterations, self.n_images = self.energies.shape
@@ -90,18 +136,26 @@ class Analyse(object):
         can plot a smooth curve and get the derivatives, that we need 
         for the tangents
         """
-        spline_linear = []
-        spline_cubic = []
-        for xv, es in zip(self.displacements, self.energies):
-            print(xv)
-            # get the spline representation of each NEB curve
-            tck_linear = splrep(xv, es, k=1)
-            tck_cubic = splrep(xv, es, k=3)
-            # spline the energies
-            spline_linear.append(splev(self.xv_for_splines, tck_linear))
-            spline_cubic.append(splev(self.xv_for_splines, tck_cubic))
-        self.spline_linear = np.array(spline_linear)
-        self.spline_cubic = np.array(spline_cubic)
+        shape = (self.n_iterations, len(self.xv_for_splines))
+        # The linear curves of all iterations are evaluated with a single call.
+        # The displacements of each iteration run from 0 to 1, so shifting the
+        # x-grid of iteration n by 2n places all grids on one increasing axis.
+        shift = 2.0 * np.arange(self.n_iterations)[:, None]
+        self.spline_linear = np.interp((self.xv_for_splines + shift).ravel(),
+                                       (self.displacements + shift).ravel(),
+                                       self.energies.ravel()).reshape(shape)
+        self.spline_cubic = np.empty(shape)
+        # every iteration has its own displacements as x-grid, so the
+        # cubic splines cannot share a basis and are built row by row
+        for n, (xv, es) in enumerate(zip(self.displacements, self.energies)):
+            # interpolating cubic B-spline of each NEB curve, the data read
+            # from the result files are finite, so the input checks are skipped
+            spl = make_interp_spline(xv, es, k=3, bc_type="not-a-knot", check_finite=False)
+            self.spline_cubic[n] = spl(self.xv_for_splines, extrapolate=False)
+        # the curves are evaluated once here, the slider and the radio
+        # buttons only pick the precomputed row of the selected spline
+        self.splines = {"linear": self.spline_linear, "cubic": self.spline_cubic}
+        self.spline_kind = "cubic"
 
     def plot(self):
         self.figure = plt.figure()
@@ -126,12 +180,9 @@ class Analyse(object):
         # inital plot
         self.curve_plot, = ax.plot(self.xv_for_splines, self.spline_cubic[0], color="#5A6CD8", lw=1.5)
         
-        self.t_plots = []
-        for i, (x, y) in enumerate(zip(self.displacements[0], self.energies[0])):
-            if self.F[0, i] > self.tolerance:
-                self.t_plots.append(ax.plot(x, y, "o", color="#DC6058", markersize=10)[0])
-            else:
-                self.t_plots.append(ax.plot(x, y, "o", color="#4FDC85", markersize=10)[0])
+        # all images are drawn by a single scatter plot
+        self.t_plots = ax.scatter(self.displacements[0], self.energies[0], c=self.marker_colors[0],
+                                  s=100, zorder=3)
 
         self.n = 0
         # axis labels
@@ -148,26 +199,17 @@ class Analyse(object):
         plt.show()
 
     def update_radio(self, val):
-        if val == "linear":
-            self.curve_plot.set_ydata(self.spline_linear[self.n])
-        elif val == "cubic":
-            self.curve_plot.set_ydata(self.spline_cubic[self.n])
+        self.spline_kind = val
+        self.curve_plot.set_ydata(self.splines[val][self.n])
         self.figure.canvas.draw_idle()
 
     def update(self, val):
         n = int(self.slider.val)
         self.figure.suptitle('Iteration: {}'.format(n))
-        for i, (x, y) in enumerate(zip(self.displacements[n], self.energies[n])):
-            if self.F[n, i] > self.tolerance:
-                self.t_plots[i].set_ydata(y)
-                self.t_plots[i].set_xdata(x)
-                self.t_plots[i].set_color("#DC6058")
-            else:
-                self.t_plots[i].set_ydata(y)
-                self.t_plots[i].set_xdata(x)
-                self.t_plots[i].set_color("#4FDC85")
-
-        self.curve_plot.set_ydata(self.spline_cubic[n])
+        self.t_plots.set_offsets(np.c_[self.displacements[n], self.energies[n]])
+        self.t_plots.set_facecolors(self.marker_colors[n])
+
+        self.curve_plot.set_ydata(self.splines[self.spline_kind][n])
         #ax.autoscale_view()
         self.figure.canvas.draw_idle()
         self.n = n
@@ -5,18 +5,116 @@ requires the scripts 'run_gaussian_09.sh', 'run_gaussian_16.sh' and 'run_qchem.s
 """
 from __future__ import print_function
 from __future__ import absolute_import
-from builtins import map
-from builtins import range
 from NEB import XYZ, AtomicData
 from NEB.Gaussian2py import Checkpoint
 
 import numpy as np
 import os
+import mmap
+import shutil
 import subprocess
-from collections import OrderedDict
+from concurrent.futures import as_completed
+from functools import lru_cache
 import json
 
-def run_gaussian_09(atomlist, directory=".", nprocs=1, mem="6Gb"):
+def _print_file(filename):
+    """
+    print the content of a text file, e.g. the log-file of a failed calculation
+    """
+    try:
+        with open(filename) as fh:
+            print(fh.read())
+    except IOError as e:
+        print(e)
+
+@lru_cache(maxsize=16)
+def _element_names(Zs):
+    """
+    upper case and capitalized element names for the tuple of atomic numbers `Zs`.
+    The atom ordering is the same for all images and steps, so the names are
+    only looked up once.
+    """
+    names = [AtomicData.atom_names[Zat-1] for Zat in Zs]
+    return [name.upper() for name in names], [name.capitalize() for name in names]
+
+def _geometry_lines(atomlist):
+    """
+    format the cartesian coordinates of all atoms (converted to Angstrom)
+    as lines of the geometry block in Gaussian and QChem input scripts
+    """
+    names, _ = _element_names(tuple(Zat for Zat, pos in atomlist))
+    positions = np.array([pos for Zat, pos in atomlist]) * AtomicData.bohr_to_angs
+    return ["%2s    %+12.10f   %+12.10f   %+12.10f \n" % (name, x, y, z)
+            for name, (x, y, z) in zip(names, positions)]
+
+def _guess_read(lines, directory, istep):
+    """
+    In all but the first NEB step, the wavefunction of the previous step in the
+    checkpoint file `grad.chk` of the image directory is used as initial guess
+    for the SCF. The geometry changes only slightly between steps, so the SCF
+    converges faster.
+
+    The run scripts execute Gaussian in a scratch directory and only copy the
+    checkpoint files named in `%OldChk=...` lines there. Therefore `grad.chk` is
+    renamed to `prev.chk`, which is requested with `%OldChk=prev.chk` in the Link 0
+    section and read with `Guess=Read` in the route section. Templates that
+    already specify a guess or an old checkpoint file are left unchanged.
+    """
+    chk = os.path.join(directory, "grad.chk")
+    if istep == 0 or not os.path.exists(chk):
+        return lines
+    for i, line in enumerate(lines):
+        if line.lstrip().startswith("#"):
+            break
+    else:
+        return lines
+    # the Link 0 section precedes the route section, which ends with a blank line
+    link0 = lines[:i]
+    route = []
+    for line in lines[i:]:
+        if line.strip() == "":
+            break
+        route.append(line)
+    if any("%oldchk" in line.lower() for line in link0) or any("guess" in line.lower() for line in route):
+        return lines
+    os.replace(chk, os.path.join(directory, "prev.chk"))
+    return link0 + ["%OldChk=prev.chk\n", lines[i].rstrip("\n") + " Guess=Read\n"] + lines[i+1:]
+
+def _remove_previous_checkpoint(directory):
+    """
+    delete the checkpoint file of the previous step (see `_guess_read`) and its
+    formatted version, which the run scripts create from all checkpoint files
+    """
+    for name in ("prev.chk", "prev.fchk"):
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+
+def _write_gaussian_input(atomlist, directory, istep=0, guess_read=True):
+    """
+    write the Gaussian input `neb.gjf` for the geometry `atomlist` to `directory`.
+    The template `neb.gjf` is read from the current folder and its placeholder
+    @geom (or line 10) is replaced by the geometry. If `guess_read` is True,
+    the wavefunction of the previous step is used as initial guess (see `_guess_read`).
+    """
+    # the template is read once and the input with the current geometry
+    # is written directly to the image directory
+    with open("neb.gjf") as old_file:
+        lines = old_file.readlines()
+    # the placeholder @geom is replaced by the current geometry
+    try:
+        index = lines.index("@geom\n")
+        end = index + 1
+    except ValueError:
+        index = end = 9
+    lines = lines[:index] + _geometry_lines(atomlist) + lines[end:]
+    if guess_read:
+        lines = _guess_read(lines, directory, istep)
+    with open("%s/neb.gjf" % directory, "w") as new_file:
+        new_file.writelines(lines)
+
+def run_gaussian_09(atomlist, directory=".", nprocs=1, mem="6Gb", istep=0, guess_read=True):
     """
     run Gaussian input script in `neb.gjf` and read energy and gradient
     from checkpoing file `grad.fchk`.
@@ -31,6 +129,9 @@ def run_gaussian_09(atomlist, directory=".", nprocs=1, mem="6Gb"):
     --------
     nprocs : int, number of processors
     mem    : str, allocated memory (e.g. '6Gb', '100Mb')
+    istep  : int, NEB optimization step, in all steps after the first one the
+             wavefunction from `grad.chk` is read as initial guess
+    guess_read: bool, set to False to always start from the guess of the template
 
     Returns
     -------
@@ -38,36 +139,24 @@ def run_gaussian_09(atomlist, directory=".", nprocs=1, mem="6Gb"):
     grad  :  gradient of total energy (in a.u.)
     """
     # create directory if it does not exist already
-    os.system("mkdir -p %s" % directory)
-    os.system("cp neb.gjf %s/neb.gjf" % directory)
+    os.makedirs(directory, exist_ok=True)
     # update geometry
     XYZ.write_xyz("%s/geometry.xyz" % directory, [atomlist])
 
-    with open("%s/neb.gjf" % directory,) as old_file:
-        lines = old_file.readlines()
-    with open("%s/neb.gjf" % directory, "w") as new_file:
-        try:
-            index = lines.index("@geom\n")
-            lines.remove("@geom\n")
-        except:
-            index = 9
-        c = AtomicData.bohr_to_angs
-        for idx, (Zat, pos) in enumerate(atomlist):
-            l = "%2s    %+12.10f   %+12.10f   %+12.10f \n" % (AtomicData.atom_names[Zat-1].upper(), pos[0]*c, pos[1]*c, pos[2]*c)
-            lines.insert(idx + index, l)
-        new_file.writelines(lines)
+    _write_gaussian_input(atomlist, directory, istep=istep, guess_read=guess_read)
     # remove number of atoms and comment
     #os.system("cd %s; tail -n +3 geometry.xyz > geom" % directory)
     # calculate electronic structure
     #print "running Gaussian..."
     # submit calculation to the cluster
-    ret  = os.system(r"cd %s; run_gaussian_09.sh --wait --fchk neb.gjf %d %s" % (directory, nprocs, mem))
+    ret = subprocess.run(["run_gaussian_09.sh", "--wait", "--fchk", "neb.gjf", str(nprocs), mem],
+                         cwd=directory).returncode
     if ret != 0:
         # Since the temporary files from each image are deleted, it is very difficult to
         # figure out why a calculation failed. Therefore the content of the log-file neb.out
         # is printed if the calculation failed.
         print(" ****** content of log-file %s/neb.out ****** " % directory)
-        os.system("cat %s/neb.out" % directory)
+        _print_file("%s/neb.out" % directory)
         print(" ****** end of log-file ****** ")
         raise RuntimeError("Return status = %s, error in Gaussian calculation, see error messages above !" % ret)
 
@@ -76,6 +165,7 @@ def run_gaussian_09(atomlist, directory=".", nprocs=1, mem="6Gb"):
 
     en   = data["_Total_Energy"]
     grad = data["_Cartesian_Gradient"]
+    _remove_previous_checkpoint(directory)
 
     ### DEBUG
     # print("Cartesian Gaussian 09 gradient in %s" % directory)
@@ -84,7 +174,7 @@ def run_gaussian_09(atomlist, directory=".", nprocs=1, mem="6Gb"):
 
     return en, grad
 
-def run_gaussian_16(atomlist, directory=".", nprocs=1, mem="6Gb"):
+def run_gaussian_16(atomlist, directory=".", nprocs=1, mem="6Gb", istep=0, guess_read=True):
     """
     run Gaussian input script in `neb.gjf` and read energy and gradient
     from checkpoing file `grad.fchk`.
@@ -99,6 +189,9 @@ def run_gaussian_16(atomlist, directory=".", nprocs=1, mem="6Gb"):
     --------
     nprocs : int, number of processors
     mem    : str, allocated memory (e.g. '6Gb', '100Mb')
+    istep  : int, NEB optimization step, in all steps after the first one the
+             wavefunction from `grad.chk` is read as initial guess
+    guess_read: bool, set to False to always start from the guess of the template
 
     Returns
     -------
@@ -106,21 +199,8 @@ def run_gaussian_16(atomlist, directory=".", nprocs=1, mem="6Gb"):
     grad  :  gradient of total energy (in a.u.)
     """
     # create directory if it does not exist already
-    os.system("mkdir -p %s" % directory)
-    os.system("cp neb.gjf %s/neb.gjf" % directory)
-    with open("%s/neb.gjf" % directory,) as old_file:
-        lines = old_file.readlines()
-    with open("%s/neb.gjf" % directory, "w") as new_file:
-        try:
-            index = lines.index("@geom\n")
-            lines.remove("@geom\n")
-        except:
-            index = 9
-        c = AtomicData.bohr_to_angs
-        for idx, (Zat, pos) in enumerate(atomlist):
-            l = "%2s    %+12.10f   %+12.10f   %+12.10f \n" % (AtomicData.atom_names[Zat-1].upper(), pos[0]*c, pos[1]*c, pos[2]*c)
-            lines.insert(idx + index, l)
-        new_file.writelines(lines)
+    os.makedirs(directory, exist_ok=True)
+    _write_gaussian_input(atomlist, directory, istep=istep, guess_read=guess_read)
     # update geometry
     XYZ.write_xyz("%s/geometry.xyz" % directory, [atomlist])
     #XYZ.write_geom("%s/geom" % directory, [atomlist])
@@ -129,13 +209,14 @@ def run_gaussian_16(atomlist, directory=".", nprocs=1, mem="6Gb"):
     # calculate electronic structure
     #print "running Gaussian..."
     # submit calculation to the cluster
-    ret  = os.system(r"cd %s; run_gaussian_16.sh --wait --fchk neb.gjf %d %s" % (directory, nprocs, mem))
+    ret = subprocess.run(["run_gaussian_16.sh", "--wait", "--fchk", "neb.gjf", str(nprocs), mem],
+                         cwd=directory).returncode
     if ret != 0:
         # Since the temporary files from each image are deleted, it is very difficult to
         # figure out why a calculation failed. Therefore the content of the log-file neb.out
         # is printed if the calculation failed.
         print(" ****** content of log-file %s/neb.out ****** " % directory)
-        os.system("cat %s/neb.out" % directory)
+        _print_file("%s/neb.out" % directory)
         print(" ****** end of log-file ****** ")
         raise RuntimeError("Return status = %s, error in Gaussian calculation, see error messages above !" % ret)
 
@@ -144,6 +225,7 @@ def run_gaussian_16(atomlist, directory=".", nprocs=1, mem="6Gb"):
 
     en   = data["_Total_Energy"]
     grad = data["_Cartesian_Gradient"]
+    _remove_previous_checkpoint(directory)
 
     ### DEBUG
     # print("Cartesian Gaussian 09 gradient in %s" % directory)
@@ -153,7 +235,25 @@ def run_gaussian_16(atomlist, directory=".", nprocs=1, mem="6Gb"):
     return en, grad
 
 
-def run_qchem(atomlist, directory=".", nprocs=1, mem="6Gb"):
+def _read_qchem_energy(filename):
+    """
+    read the last total energy printed in the QChem output file `filename`
+    """
+    with open(filename, "rb") as fh:
+        assert os.fstat(fh.fileno()).st_size > 0, "Total energy not found in QChem output, see %s!" % filename
+        mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            pos = mm.rfind(b"Total energy")
+            assert pos != -1, "Total energy not found in QChem output, see %s!" % filename
+            # 'Total energy in the final basis set =   <energy>'
+            start = mm.rfind(b"\n", 0, pos) + 1
+            end = mm.find(b"\n", pos)
+            line = mm[start:end] if end != -1 else mm[start:]
+        finally:
+            mm.close()
+    return float(line.split()[8])
+
+def run_qchem(atomlist, directory=".", nprocs=1, mem="6Gb", istep=0, guess_read=True):
     """
     run QChem input script in `neb.in` and read energy and gradient
     from checkpoing file `neb.fchk`.
@@ -168,6 +268,8 @@ def run_qchem(atomlist, directory=".", nprocs=1, mem="6Gb"):
     --------
     nprocs : int, number of processors
     mem    : str, allocated memory (e.g. '6Gb', '100Mb')
+    istep  : int, NEB optimization step (not used)
+    guess_read: bool (not used)
 
     Returns
     -------
@@ -175,17 +277,12 @@ def run_qchem(atomlist, directory=".", nprocs=1, mem="6Gb"):
     grad  :  gradient of total energy (in a.u.)
     """
     # create directory if it does not exist already
-    os.system("mkdir -p %s" % directory)
+    os.makedirs(directory, exist_ok=True)
     qchem_file = "%s/neb.in" % directory
-    os.system("cp neb.in %s" % qchem_file)
     # update geometry
-    geom_lines = []
-    c = AtomicData.bohr_to_angs
-    for Zat,pos in atomlist:
-        l = "%2s    %+12.10f   %+12.10f   %+12.10f \n" % (AtomicData.atom_names[Zat-1].upper(), pos[0]*c, pos[1]*c, pos[2]*c)
-        geom_lines.append(l)
+    geom_lines = _geometry_lines(atomlist)
 
-    with open(qchem_file) as fh:
+    with open("neb.in") as fh:
         lines = fh.readlines()
 
     # check if excited state calculation is performed
@@ -223,22 +320,23 @@ def run_qchem(atomlist, directory=".", nprocs=1, mem="6Gb"):
     lines = lines[0:start+2] + geom_lines + lines[end:]
 
     with open(qchem_file, "w") as fh:
-        for l in lines:
-            fh.write(l)
+        fh.write("".join(lines))
 
     # calculate electronic structure
     #print "running QChem ..."
     # submit calculation to the cluster
     if state_deriv == 0:
-        ret  = os.system(r"cd %s; run_qchem.sh --wait neb.in %d %s" % (directory, nprocs, mem))
+        ret = subprocess.run(["run_qchem.sh", "--wait", "neb.in", str(nprocs), mem],
+                             cwd=directory).returncode
     else:
-        ret  = os.system(r"cd %s; run_qchem.sh --wait --save neb.in %d %s" % (directory, nprocs, mem))
+        ret = subprocess.run(["run_qchem.sh", "--wait", "--save", "neb.in", str(nprocs), mem],
+                             cwd=directory).returncode
     if ret != 0:
         # Since the temporary files from each image are deleted, it is very difficult to
         # figure out why a calculation failed. Therefore the content of the log-file neb.out
         # is printed if the calculation failed.
         print(" ****** content of log-file %s/neb.out ****** " % directory)
-        os.system("cat %s/neb.out" % directory)
+        _print_file("%s/neb.out" % directory)
         print(" ****** end of log-file ****** ")
         raise RuntimeError("Return status = %s, error in QChem calculation, see error messages above !" % ret)
 
@@ -246,9 +344,7 @@ def run_qchem(atomlist, directory=".", nprocs=1, mem="6Gb"):
     if state_deriv == 0:
         # Ground state calculation
         # total energy is not saved in the checkpoint file, grep it from output file
-        en = subprocess.check_output("cd %s; grep 'Total energy' neb.out | awk '{print $9}'" % directory, shell=True).strip()
-        assert en != "", "Total energy not found in QChem output, see %s/neb.out!" % directory
-        en = float(en)
+        en = _read_qchem_energy("%s/neb.out" % directory)
 
         # read gradient from checkpoint files
         data = Checkpoint.parseCheckpointFile("%s/neb.fchk" % directory)
@@ -268,7 +364,7 @@ def run_qchem(atomlist, directory=".", nprocs=1, mem="6Gb"):
                     break
         grad = np.array(grad, dtype=float) 
         #clean up the tmp directory
-        os.system("rm -rf %s/tmp/" % directory)
+        shutil.rmtree("%s/tmp" % directory, ignore_errors=True)
     ### DEBUG
     #print("Cartesian QChem gradient in %s" % directory)
     #print(grad)
@@ -276,7 +372,7 @@ def run_qchem(atomlist, directory=".", nprocs=1, mem="6Gb"):
 
     return en, grad
 
-def run_bagel(atomlist, directory=".", nprocs=1, mem="6Gb"):
+def run_bagel(atomlist, directory=".", nprocs=1, mem="6Gb", istep=0, guess_read=True):
     """
     run BAGEL input script in `neb.json` and read energy and gradient back in.
 
@@ -290,6 +386,8 @@ def run_bagel(atomlist, directory=".", nprocs=1, mem="6Gb"):
     --------
     nprocs : int, number of processors
     mem    : str, allocated memory (e.g. '6Gb', '100Mb')
+    istep  : int, NEB optimization step (not used)
+    guess_read: bool (not used)
 
     Returns
     -------
@@ -297,12 +395,11 @@ def run_bagel(atomlist, directory=".", nprocs=1, mem="6Gb"):
     grad  :  gradient of total energy (in a.u.)
     """
     # create directory if it does not exist already
-    os.system("mkdir -p %s" % directory)
+    os.makedirs(directory, exist_ok=True)
     bagel_file = "%s/neb.json" % directory
-    os.system("cp neb.json %s" % bagel_file)
     # update geometry
     # load input from template
-    with open(bagel_file, "r") as f:
+    with open("neb.json", "r") as f:
         input_sec = json.load(f)
     # find molecule section
     for sec in input_sec["bagel"]:
@@ -317,13 +414,11 @@ def run_bagel(atomlist, directory=".", nprocs=1, mem="6Gb"):
 
     # replace geometry with current coordinates
     natoms = len(atomlist)
-    molecule_sec["geometry"] = []
-    for i in range(0, natoms):
-        atom = OrderedDict()
-        Z,pos = atomlist[i]
-        atom["atom"] = AtomicData.atom_names[Z-1].capitalize()
-        atom["xyz"] = list(pos)
-        molecule_sec["geometry"].append(atom)
+    _, names = _element_names(tuple(Z for Z, pos in atomlist))
+    molecule_sec["geometry"] = [None] * natoms
+    for i, (name, (Z, pos)) in enumerate(zip(names, atomlist)):
+        # dicts keep the insertion order, so "atom" is written before "xyz"
+        molecule_sec["geometry"][i] = {"atom": name, "xyz": list(pos)}
 
     with open(bagel_file, "w") as fh:
         json.dump(input_sec, fh, indent=4)
@@ -331,32 +426,60 @@ def run_bagel(atomlist, directory=".", nprocs=1, mem="6Gb"):
     # calculate electronic structure
     #print "running BAGEL ..."
     # submit calculation to the cluster
-    ret  = os.system(r"cd %s; run_bagel.sh neb.json %d %s --wait" % (directory, nprocs, mem))
+    ret = subprocess.run(["run_bagel.sh", "neb.json", str(nprocs), mem, "--wait"],
+                         cwd=directory).returncode
     if ret != 0:
         # Since the temporary files from each image are deleted, it is very difficult to
         # figure out why a calculation failed. Therefore the content of the log-file neb.out
         # is printed if the calculation failed.
         print(" ****** content of log-file %s/neb.out ****** " % directory)
-        os.system("cat %s/neb.out" % directory)
+        _print_file("%s/neb.out" % directory)
         print(" ****** end of log-file ****** ")
         raise RuntimeError("Return status = %s, error in BAGEL calculation, see error messages above !" % ret)
 
     # read energy and gradient (called "forces" in BAGEL, Arrrg)
-    grad = np.zeros(3*natoms)
     with open("%s/FORCE.out" % directory) as fh:
         # First line contains energy (in Hartree)
         en = float(fh.readline())
         # skip one line
         fh.readline()
-        # read gradients on atoms
-        for i in range(0, natoms):
-            parts = fh.readline().split()
-            x,y,z = list(map(float, parts[1:4]))
-            grad[3*i:3*(i+1)] = x,y,z
+        # read gradients on atoms, columns 2-4 contain the x,y,z components
+        grad = np.loadtxt(fh, usecols=(1,2,3), max_rows=natoms, ndmin=2).reshape(-1)
 
     return en, grad
 
 
+def iter_batch(calculator, atomlists, directories, executor, **kwds):
+    """
+    submit the calculations for several geometries to `executor` and yield
+    the results as soon as the single calculations finish. A free worker
+    starts with the next pending geometry immediately, so expensive images
+    do not hold back the cheaper ones.
+
+    Parameters
+    ----------
+    calculator : function returned by `get_calculator`
+    atomlists  : list of geometries, each is a list of tuples (Zat,[x,y,z])
+    directories: list of directories, one for each geometry
+    executor   : executor to which the calculations are submitted
+
+    Optional
+    --------
+    kwds     : further keywords passed on to the calculator (nprocs, mem, istep),
+               keywords that are the same for all calculations can also be bound
+               to the calculator with `functools.partial`
+
+    Returns
+    -------
+    iterator over tuples (i, (en, grad)) in the order in which the
+    calculations finish, i is the index of the geometry in `atomlists`
+    """
+    futures = {executor.submit(calculator, atomlist, directory=directory, **kwds) : i
+               for i, (atomlist, directory) in enumerate(zip(atomlists, directories))}
+    for future in as_completed(futures):
+        yield futures[future], future.result()
+
+
 def get_calculator(name):
     """
     retrieve function for calculating electronic structure (energy + gradient)
@@ -0,0 +1,122 @@
+"""
+numerical kernels of the NEB optimization that act on all images at once
+
+The positions, forces and tangents of the images are stored as rows of
+(images, 3*atoms) arrays. The results are written into preallocated output
+arrays, so that the buffers can be reused in every optimization step.
+"""
+from __future__ import division
+
+import numpy as np
+from numpy.linalg import norm
+
+def compute_tangents(R, V, out):
+    """
+    improved tangent estimate by Henkelman/Jonsson at the positions of the images
+
+    Parameters:
+    ===========
+    R: array (images, 3*atoms) with the positions of the images
+    V: array (images,) with the energies of the images
+    out: array (images, 3*atoms), the normalized tangents are written into the
+         rows of the interior images, the rows of the end points are not touched
+
+    Returns:
+    ========
+    out
+    """
+    # taup and taum are the segments to the next and to the previous image
+    taup = R[2:] - R[1:-1]
+    taum = R[1:-1] - R[:-2]
+    dVp = V[2:] - V[1:-1]
+    dVm = V[1:-1] - V[:-2]
+    # at extrema the tangent is a mixture of both segments weighted by the energy differences
+    dVmax = np.maximum(abs(dVp), abs(dVm))[:,None]
+    dVmin = np.minimum(abs(dVp), abs(dVm))[:,None]
+    tangents = np.where((V[2:] > V[:-2])[:,None], taup*dVmax + taum*dVmin,
+                        np.where((V[2:] < V[:-2])[:,None], taup*dVmin + taum*dVmax,
+                                 R[2:] - R[:-2]))
+    # the energy increases (decreases) monotonically across the image
+    uphill = (dVm >= 0) & (dVp >= 0)
+    downhill = (dVp < 0) & (dVm < 0)
+    tangents = np.where(uphill[:,None], taup, np.where(downhill[:,None], taum, tangents))
+    # normalize tangents
+    np.divide(tangents, norm(tangents, axis=1)[:,None], out=out[1:-1])
+    return out
+
+def compute_effective_forces(R, F, V, switch, ks, tangents, out):
+    """
+    effective forces (spring forces parallel to the tangents and true forces
+    perpendicular to them) acting on the interior images
+
+    Parameters:
+    ===========
+    R: array (images, 3*atoms) with the positions of the images
+    F: array (images, 3*atoms) with the true forces acting on the images
+    V: array (images,) with the energies of the images
+    switch: bool array (images-1,), True for the segments between images
+            on different electronic states
+    ks: array (images-1,) with the force constants of the springs along the segments
+    tangents: array (images, 3*atoms) with the normalized tangents
+    out: array (images, 3*atoms), the effective forces are written into the
+         rows of the interior images, the rows of the end points are not touched
+
+    Returns:
+    ========
+    out
+    """
+    T = tangents[1:-1]
+    # segments between neighbouring images and their lengths are computed once,
+    # the segment to the next image of image i is the segment to the previous one of image i+1
+    seg = R[1:] - R[:-1]
+    seg_len = norm(seg, axis=1)
+    dRp, dRm = seg[1:], seg[:-1]
+    # interfaces where the path switches to another electronic state
+    switch_p, switch_m = switch[1:,None], switch[:-1,None]
+    kp, km = ks[1:,None], ks[:-1,None]
+    # spring force parallel to tangents
+    # towards the next image
+    dE = V[2:] - V[1:-1]
+    F1 = dRp + (dE - np.einsum('ij,ij->i', F[2:], dRp))[:,None] * F[2:]
+    F2 = -dRp + (-dE + np.einsum('ij,ij->i', F[1:-1], dRp))[:,None] * F[1:-1]
+    Fspring = kp * np.where(switch_p,
+                            F1 + F2,
+                            seg_len[1:,None] * T) # new implementation by Henkelman/Jonsson
+    # towards the previous image
+    Fspring -= km * np.where(switch_m,
+                             np.einsum('ij,ij->i', dRm, T)[:,None] * T, # from original implementation of NEB
+                             seg_len[:-1,None] * T) # new implementation by Henkelman/Jonsson
+    # perpendicular component of true forces
+    Fnudge = F[1:-1] - np.einsum('ij,ij->i', F[1:-1], T)[:,None] * T
+    np.add(Fspring, Fnudge, out=out[1:-1])
+    return out
+
+def verlet_step(R, Rlast, effF, dt, friction, mass, Rnext, first_step=False):
+    """
+    damped Verlet step for the positions of all images
+
+    Parameters:
+    ===========
+    R: array (images, 3*atoms) with the current positions R(t)
+    Rlast: array (images, 3*atoms) with the positions R(t-dt) of the last step
+    effF: array (images, 3*atoms) with the effective forces
+    dt: time step
+    friction: damping coefficient between 0.0 (no damping) and 1.0
+    mass: mass of the beads
+    Rnext: array (images, 3*atoms), the new positions R(t+dt) are written into it
+    first_step: if True, an Euler step without initial velocity is made instead
+
+    Returns:
+    ========
+    Rnext
+    """
+    if first_step:
+        # Euler step, without initial velocity
+        np.multiply(effF, 0.5/mass*pow(dt,2), out=Rnext)
+        Rnext += R
+    else:
+        # damped Verlet algorithm
+        np.multiply(effF, 1.0/mass*pow(dt,2), out=Rnext)
+        Rnext += (2.0-friction)*R
+        Rnext -= (1.0-friction)*Rlast
+    return Rnext
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from NEB import XYZ
+from NEB import Analyse
+from NEB.Analyse import _chain_lines, _read_iterations
+
+
+def test_chain_lines_counts(tmp_path):
+    files = []
+    for i, n in enumerate((9, 11)):
+        data = np.c_[np.arange(n), np.arange(n)]
+        files.append(str(tmp_path / ("path_energies_%4.4d.dat" % i)))
+        np.savetxt(files[-1], data, header="index energy")
+    counts = []
+    energies = np.loadtxt(_chain_lines(files, counts), usecols=(1,))
+    # the counts are complete once all lines have been read,
+    # comment lines are not counted
+    assert counts == [9, 11]
+    assert energies.shape == (20,)
+
+
+def test_read_iterations_pool(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    files = []
+    for i in range(3):
+        geometries = [list(zip([8, 1, 1], rng.normal(size=(3, 3)))) for _ in range(4)]
+        gradients = [rng.normal(size=(3, 3)) for _ in range(4)]
+        files.append(str(tmp_path / ("neb_%4.4d.xyz" % i)))
+        XYZ.write_xyz_and_gradients(files[-1], geometries, gradients, title=["Energy=0.0"]*4)
+    # few files are read in the current process, many in worker processes
+    serial = list(_read_iterations(files))
+    monkeypatch.setattr(Analyse, "min_files_for_pool", 2)
+    pooled = list(_read_iterations(files))
+    assert len(serial) == len(pooled) == 3
+    for (R1, G1), (R2, G2) in zip(serial, pooled):
+        assert R1.shape == G1.shape == (4, 9)
+        assert np.array_equal(R1, R2) and np.array_equal(G1, G2)
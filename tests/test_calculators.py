@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from NEB.calculators import _write_gaussian_input, _remove_previous_checkpoint, iter_batch
+
+TEMPLATE = """%Chk=grad.chk
+%Nproc=1
+%Mem=1Gb
+# B3LYP/def2SVP Force
+NoSymm
+
+s0 gradient
+
+0 1
+@geom
+
+
+"""
+
+ATOMLIST = [(8, [0.0, 0.0, 0.0]), (1, [0.0, 0.0, 1.8]), (1, [1.8, 0.0, 0.0])]
+
+
+@pytest.fixture
+def image_dir(tmp_path, monkeypatch):
+    """image directory below a folder that contains the template neb.gjf"""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "neb.gjf").write_text(TEMPLATE)
+    directory = tmp_path / "IMAGE_01"
+    directory.mkdir()
+    return directory
+
+
+def write_input(directory, **kwds):
+    _write_gaussian_input(ATOMLIST, str(directory), **kwds)
+    return (directory / "neb.gjf").read_text().splitlines()
+
+
+@pytest.mark.parametrize("istep, chk", [(0, False), (0, True), (3, False)])
+def test_no_guess_read(image_dir, istep, chk):
+    if chk:
+        (image_dir / "grad.chk").write_text("chk")
+    lines = write_input(image_dir, istep=istep)
+    assert "# B3LYP/def2SVP Force" in lines
+    assert not any("%oldchk" in line.lower() or "guess" in line.lower() for line in lines)
+    # the geometry replaces the placeholder
+    assert "@geom" not in lines
+    assert len([line for line in lines if line.startswith(" O") or line.startswith(" H")]) == 3
+    assert os.path.exists(image_dir / "grad.chk") == chk
+
+
+def test_guess_read(image_dir):
+    (image_dir / "grad.chk").write_text("chk")
+    lines = write_input(image_dir, istep=3)
+    route = lines.index("# B3LYP/def2SVP Force Guess=Read")
+    # the old checkpoint file is requested in the Link 0 section, so that
+    # the run scripts copy it to the scratch directory
+    assert lines[:route] == ["%Chk=grad.chk", "%Nproc=1", "%Mem=1Gb", "%OldChk=prev.chk"]
+    assert not (image_dir / "grad.chk").exists()
+    assert (image_dir / "prev.chk").read_text() == "chk"
+
+
+def test_remove_previous_checkpoint(image_dir):
+    for name in ("prev.chk", "prev.fchk", "grad.chk", "grad.fchk"):
+        (image_dir / name).write_text("chk")
+    _remove_previous_checkpoint(str(image_dir))
+    assert sorted(os.listdir(image_dir)) == ["grad.chk", "grad.fchk"]
+    # nothing to remove in the first step
+    _remove_previous_checkpoint(str(image_dir))
+
+
+def test_guess_read_switched_off(image_dir):
+    (image_dir / "grad.chk").write_text("chk")
+    lines = write_input(image_dir, istep=3, guess_read=False)
+    assert "# B3LYP/def2SVP Force" in lines
+    assert not any("%oldchk" in line.lower() or "guess" in line.lower() for line in lines)
+    assert (image_dir / "grad.chk").exists()
+
+
+def test_guess_of_template_is_kept(image_dir, tmp_path):
+    (tmp_path / "neb.gjf").write_text(TEMPLATE.replace("Force", "Force Guess=Huckel"))
+    (image_dir / "grad.chk").write_text("chk")
+    lines = write_input(image_dir, istep=3)
+    assert "# B3LYP/def2SVP Force Guess=Huckel" in lines
+    assert not any("%oldchk" in line.lower() for line in lines)
+
+
+def test_iter_batch_order():
+    # the calculation of the first geometry is held back until the results
+    # of all others have been received, so they cannot arrive in the order of submission
+    release = threading.Event()
+
+    def calculator(atomlist, directory=".", nprocs=1, mem="6Gb", istep=0):
+        if directory == "IMAGE_00":
+            assert release.wait(5)
+        Z, pos = atomlist[0]
+        return float(pos[0]), np.array(pos) * istep
+
+    atomlists = [[(1, [float(i), 0.0, 0.0])] for i in range(4)]
+    directories = ["IMAGE_%2.2d" % i for i in range(4)]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        batch = iter_batch(calculator, atomlists, directories, executor, istep=2)
+        results = [next(batch) for _ in range(3)]
+        release.set()
+        results += list(batch)
+    # every result carries the index of its geometry
+    assert sorted(i for i, _ in results[:3]) == [1, 2, 3]
+    assert results[-1][0] == 0
+    for i, (en, grad) in results:
+        assert en == float(i)
+        assert np.array_equal(grad, [2.0*i, 0.0, 0.0])
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+compare the kernels in NEB.kernels with the per-image loops they replace
+"""
+
+import numpy as np
+from numpy.linalg import norm
+
+import pytest
+
+from NEB.kernels import compute_tangents, compute_effective_forces, verlet_step
+
+K, K_SWITCH = 0.3, 5.0
+
+
+def tangents_loop(R, V):
+    tangents = np.zeros(R.shape)
+    for i in range(1, len(R)-1):
+        if V[i-1] <= V[i] <= V[i+1]:
+            t = R[i+1] - R[i]
+        elif V[i+1] < V[i] < V[i-1]:
+            t = R[i] - R[i-1]
+        else:
+            dVmax = max(abs(V[i+1] - V[i]), abs(V[i-1] - V[i]))
+            dVmin = min(abs(V[i+1] - V[i]), abs(V[i-1] - V[i]))
+            taup = R[i+1] - R[i]
+            taum = R[i] - R[i-1]
+            if V[i+1] > V[i-1]:
+                t = taup*dVmax + taum*dVmin
+            elif V[i+1] < V[i-1]:
+                t = taup*dVmin + taum*dVmax
+            else:
+                t = R[i+1] - R[i-1]
+        tangents[i] = t / norm(t)
+    return tangents
+
+
+def effective_forces_loop(R, F, V, states, tangents):
+    effF = np.zeros(R.shape)
+    for i in range(1, len(R)-1):
+        if states[i+1] != states[i]:
+            dR = R[i+1] - R[i]
+            dE = V[i+1] - V[i]
+            F1 = dR + (dE - np.dot(F[i+1], dR)) * F[i+1]
+            F2 = -dR + (-dE + np.dot(F[i], dR)) * F[i]
+            Fspring = K_SWITCH * (F1 + F2)
+        else:
+            Fspring = K * norm(R[i+1] - R[i]) * tangents[i]
+        if states[i] != states[i-1]:
+            Fspring -= np.dot(K_SWITCH*(R[i] - R[i-1]), tangents[i]) * tangents[i]
+        else:
+            Fspring -= K*norm(R[i] - R[i-1]) * tangents[i]
+        Fnudge = F[i] - np.dot(F[i], tangents[i])*tangents[i]
+        effF[i] = Fspring + Fnudge
+    return effF
+
+
+def springs(states):
+    states = np.asarray(states)
+    switch = states[1:] != states[:-1]
+    return switch, np.where(switch, K_SWITCH, K)
+
+
+@pytest.mark.parametrize("V", [
+    [0.0, 1.0, 2.0],    # uphill
+    [2.0, 1.0, 0.0],    # downhill
+    [0.0, 2.0, 1.0],    # maximum, next image higher than previous one
+    [1.0, 2.0, 0.0],    # maximum, previous image higher than next one
+    [1.0, 0.0, 2.0],    # minimum
+    [1.0, 2.0, 1.0],    # maximum between images of equal energy
+    [1.0, 1.0, 1.0],    # all energies equal
+])
+def test_tangents_cases(V):
+    rng = np.random.default_rng(0)
+    R = rng.normal(size=(3, 6))
+    V = np.array(V)
+    out = np.zeros(R.shape)
+    compute_tangents(R, V, out)
+    assert np.allclose(out, tangents_loop(R, V), rtol=1e-12, atol=1e-14)
+    # the end points have no tangents
+    assert not out[0].any() and not out[-1].any()
+
+
+def test_tangents_path():
+    rng = np.random.default_rng(1)
+    R = rng.normal(size=(9, 6))
+    V = np.array([0.0, 0.5, 1.0, 0.8, 0.8, 1.5, 0.2, 0.2, 0.1])
+    out = np.zeros(R.shape)
+    compute_tangents(R, V, out)
+    assert np.allclose(out, tangents_loop(R, V), rtol=1e-12, atol=1e-14)
+
+
+@pytest.mark.parametrize("states", [
+    [0, 0, 0, 0, 0, 0, 0],
+    [0, 0, 0, 1, 1, 1, 1],
+    [0, 1, 1, 0, 0, 1, 1],
+])
+def test_effective_forces(states):
+    rng = np.random.default_rng(2)
+    R = rng.normal(size=(7, 6))
+    F = rng.normal(size=(7, 6))
+    V = rng.normal(size=7)
+    tangents = tangents_loop(R, V)
+    switch, ks = springs(states)
+    out = np.zeros(R.shape)
+    compute_effective_forces(R, F, V, switch, ks, tangents, out)
+    assert np.allclose(out, effective_forces_loop(R, F, V, states, tangents), rtol=1e-12, atol=1e-14)
+    # the rows of the end points are not touched
+    assert not out[0].any() and not out[-1].any()
+
+
+def test_single_image_slices():
+    # the kernels are called on slices of three images when the
+    # results of the calculations arrive one by one
+    rng = np.random.default_rng(3)
+    R = rng.normal(size=(7, 6))
+    F = rng.normal(size=(7, 6))
+    V = rng.normal(size=7)
+    states = [0, 0, 1, 1, 0, 0, 0]
+    switch, ks = springs(states)
+    tangents = np.zeros(R.shape)
+    effF = np.zeros(R.shape)
+    for i in range(1, len(R)-1):
+        triple = slice(i-1, i+2)
+        segments = slice(i-1, i+1)
+        compute_tangents(R[triple], V[triple], tangents[triple])
+        compute_effective_forces(R[triple], F[triple], V[triple], switch[segments], ks[segments],
+                                 tangents[triple], effF[triple])
+    ref_tangents = tangents_loop(R, V)
+    assert np.allclose(tangents, ref_tangents, rtol=1e-12, atol=1e-14)
+    assert np.allclose(effF, effective_forces_loop(R, F, V, states, ref_tangents), rtol=1e-12, atol=1e-14)
+
+
+@pytest.mark.parametrize("first_step", [True, False])
+def test_verlet_step(first_step):
+    rng = np.random.default_rng(4)
+    R, Rlast, effF = rng.normal(size=(3, 5, 6))
+    dt, friction, mass = 0.1, 0.2, 1.5
+    Rnext = np.empty_like(R)
+    out = verlet_step(R, Rlast, effF, dt, friction, mass, Rnext, first_step=first_step)
+    assert out is Rnext
+    for i in range(len(R)):
+        if first_step:
+            ref = R[i] + 0.5*effF[i]/mass*pow(dt,2)
+        else:
+            ref = (2.0-friction)*R[i] - (1.0-friction)*Rlast[i] + effF[i]/mass*pow(dt,2)
+        assert np.allclose(Rnext[i], ref, rtol=1e-12, atol=1e-14)